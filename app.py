@@ -1,47 +1,64 @@
+import os
+from functools import lru_cache
+
 import streamlit as st
 
 from src.openai_chain import OpenAIChain, OpenAIRAGChain
+from src.vectorstore import VectorDB, get_embedding_model
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
 
 
-@st.cache_resource
-def load_chain(_chat_memory, pdf_chat=False, uploaded_file=None, db_type='pinecone'):
+@st.cache_resource(max_entries=2, ttl=3600)
+def load_vector_db(db_type='pinecone'):
+    """
+    Load the vector database for the selected type.
+    This is the only resource shared between sessions; it is bounded to one entry per database type
+    and expires after an hour so connections are not kept forever.
+    """
+    return VectorDB(db_type, 'any', embedding=get_embedding_model())
+
+
+def load_chain(chat_memory, pdf_chat=False, uploaded_file=None, db_type='pinecone'):
     """
     Load the appropriate chain based on whether PDF chat is enabled.
-    The _chat_memory parameter is prefixed with underscore to tell Streamlit not to hash it.
+    The chain holds this session's chat memory, so it is kept in st.session_state and released together
+    with the session; it is only rebuilt when pdf_chat, the uploaded file name or db_type changes.
     """
-    try:
-        if pdf_chat and uploaded_file:
-            return OpenAIRAGChain(_chat_memory, uploaded_file=uploaded_file, db_type=db_type)
+    if pdf_chat and uploaded_file:
+        chain_key = ('rag', uploaded_file.name, db_type)
+    else:
+        chain_key = ('chat',)
+
+    if st.session_state.get('chain_key') != chain_key:
+        if chain_key[0] == 'rag':
+            # Every change that leads here also sets knowledge_change, so the file is indexed once, by update_chain
+            st.session_state.chain = OpenAIRAGChain(chat_memory, db_type=db_type, vector_db=load_vector_db(db_type))
         else:
-            return OpenAIChain(_chat_memory)
-    except Exception as e:
-        st.error(f"Failed to load chain: {str(e)}")
-        return None
+            st.session_state.chain = OpenAIChain(chat_memory)
+        st.session_state.chain_key = chain_key
+
+    return st.session_state.chain
 
 
 def file_uploader_change():
     """Handle file upload changes and update session state accordingly."""
     if st.session_state.uploaded_file:
         if not st.session_state.pdf_chat:
-            clear_cache()
             st.session_state.pdf_chat = True
         st.session_state.knowledge_change = True
     else:
-        clear_cache()
         st.session_state.pdf_chat = False
 
 
 def toggle_pdf_chat_change():
     """Handle PDF chat toggle changes."""
-    clear_cache()
     if st.session_state.pdf_chat and st.session_state.uploaded_file:
         st.session_state.knowledge_change = True
 
 
 def database_change():
     """Handle database type changes."""
-    clear_cache()
+    check_environment_variables.cache_clear()
     if st.session_state.pdf_chat and st.session_state.uploaded_file:
         st.session_state.knowledge_change = True
 
@@ -58,31 +75,29 @@ def set_send_input():
     clear_input_field()
 
 
-def clear_cache():
-    """Clear all cached resources."""
-    st.cache_resource.clear()
-
-
 def initial_session_state():
     """Initialize session state variables."""
     st.session_state.send_input = False
     st.session_state.knowledge_change = False
 
 
-def check_environment_variables():
-    """Check if required environment variables are set."""
-    import os
+@lru_cache(maxsize=2)
+def check_environment_variables(db_type='pinecone'):
+    """
+    Check if required environment variables are set.
+    The result is cached per database type; database_change clears it so switching databases re-checks.
+    """
     missing_vars = []
     
     if not os.environ.get('OPENAI_API_KEY'):
         missing_vars.append('OPENAI_API_KEY')
     
     # Only check Pinecone if it's selected
-    if st.session_state.get('database_type', 'pinecone') == 'pinecone':
+    if db_type == 'pinecone':
         if not os.environ.get('PINECONE_API_KEY'):
             missing_vars.append('PINECONE_API_KEY')
     
-    return missing_vars
+    return tuple(missing_vars)
 
 
 def main():
@@ -113,7 +128,7 @@ def main():
                                             on_change=file_uploader_change)
 
     # Check environment variables
-    missing_vars = check_environment_variables()
+    missing_vars = check_environment_variables(db_type)
     if missing_vars:
         st.error(f"Missing required environment variables: {', '.join(missing_vars)}")
         st.info("Please set these environment variables in your .env file or system environment.")
@@ -129,8 +144,10 @@ def main():
     if 'send_input' not in st.session_state:
         initial_session_state()
 
-    # Chat history
-    chat_history = StreamlitChatMessageHistory(key='history')
+    # Chat history, created once per session
+    if 'chat_history' not in st.session_state:
+        st.session_state.chat_history = StreamlitChatMessageHistory(key='history')
+    chat_history = st.session_state.chat_history
 
     # Display chat history
     with chat_container:
@@ -139,12 +156,18 @@ def main():
 
     # Load chain with proper error handling
     try:
-        llm_chain = load_chain(
-            _chat_memory=chat_history,
-            pdf_chat=st.session_state.pdf_chat,
-            uploaded_file=st.session_state.uploaded_file[0] if st.session_state.uploaded_file else None,
-            db_type=db_type
-        )
+        uploaded_file = st.session_state.uploaded_file[0] if st.session_state.uploaded_file else None
+        try:
+            llm_chain = load_chain(
+                chat_memory=chat_history,
+                pdf_chat=st.session_state.pdf_chat,
+                uploaded_file=uploaded_file,
+                db_type=db_type
+            )
+        except Exception as e:
+            # chain_key is only stored on success, so a failed load is retried on the next rerun
+            st.error(f"Failed to load chain: {str(e)}")
+            llm_chain = None
         
         if llm_chain is None:
             st.error("Failed to initialize chat chain. Please check your configuration.")
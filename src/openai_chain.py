@@ -57,7 +57,7 @@ class OpenAIChain:
 
 
 class OpenAIRAGChain:
-    def __init__(self, chat_memory, uploaded_file=None, db_type='pinecone'):
+    def __init__(self, chat_memory, uploaded_file=None, db_type='pinecone', vector_db=None):
         """
         Initialize RAG chain with specified database type.
         
@@ -65,9 +65,10 @@ class OpenAIRAGChain:
             chat_memory: Chat memory object
             uploaded_file: Uploaded PDF file
             db_type: Database type ('pinecone' or 'chroma')
+            vector_db: Existing VectorDB to reuse; a new one of `db_type` is created if omitted
         """
         # initialize vector db with specified type
-        self.vector_db = VectorDB(db_type, 'any')
+        self.vector_db = vector_db or VectorDB(db_type, 'any')
         if uploaded_file:
             self.update_knowledge_base(uploaded_file)
 
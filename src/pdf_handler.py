@@ -1,10 +1,36 @@
 import os
-import uuid
+import glob
+import time
+import shutil
+import hashlib
 import tempfile
+import multiprocessing
+from typing import Iterable
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 from langchain_community.document_loaders import PyPDFLoader, PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema.document import Document
+from semantic_text_splitter import TextSplitter
+
+
+COPY_CHUNK_SIZE = 1 << 20
+# Extracted files unused for this many seconds are deleted
+EXTRACT_CACHE_TTL = 24 * 60 * 60
+
+
+@lru_cache(maxsize=4)
+def _splitter(chunk_size, overlap, tiktoken_model=None):
+    """
+    Shared native (Rust) text splitter for a chunking configuration.
+
+    Sizes are in characters, or in tokens of `tiktoken_model` when given; building a token-based
+    splitter loads the tokenizer, so each configuration is built once per process.
+    """
+    if tiktoken_model:
+        return TextSplitter.from_tiktoken_model(tiktoken_model, chunk_size, overlap=overlap)
+
+    return TextSplitter(chunk_size, overlap=overlap)
 
 
 def create_cache_dir(directory=None):
@@ -16,82 +42,175 @@ def create_cache_dir(directory=None):
     return directory
 
 
-def load_pdf(file_path):
-    """Load a single PDF file."""
+def load_pdf(file_path) -> Iterable[Document]:
+    """Lazily load a single PDF file, one page at a time."""
     loader = PyPDFLoader(file_path)
-    return loader.load()
+    yield from loader.lazy_load()
+
 
+def _load_pdf_pages(file_path) -> list[Document]:
+    """Load a single PDF file as a list; generators cannot be returned from worker processes."""
+    return list(load_pdf(file_path))
 
-def load_pdf_directory(directory):
-    """Load all PDF files from a directory."""
+
+def list_pdf_files(directory):
+    """List the PDF files in a directory."""
+    return sorted(glob.glob(os.path.join(directory, '*.pdf')))
+
+
+def load_pdf_directory(directory) -> Iterable[Document]:
+    """Lazily load all PDF files from a directory, one page at a time."""
     loader = PyPDFDirectoryLoader(directory)
-    return loader.load()
+    yield from loader.lazy_load()
+
+
+def load_pdf_parallel(directory, max_workers=None) -> Iterable[Document]:
+    """Load all PDF files from a directory, parsing one file per process (see `load_pdf_files`)."""
+    yield from load_pdf_files(list_pdf_files(directory), max_workers=max_workers)
+
+
+def load_pdf_files(paths, max_workers=None) -> Iterable[Document]:
+    """
+    Load PDF files, parsing one file per process.
 
+    PDF text extraction is CPU-bound, so files are spread across processes rather than threads.
+    Documents are yielded file by file, in the order of `paths`; a single file is streamed page by page.
 
-def split_pdf(pdfs: list[Document]):
+    Args:
+        paths (list[str]): Paths of the PDF files
+        max_workers (int): Maximum number of processes (defaults to the CPU count)
+
+    Yields:
+        Document: Loaded PDF pages.
     """
-    Splits a list of Document objects into smaller chunks for retrieval purposes.
+    max_workers = min(max_workers or os.cpu_count() or 1, len(paths))
+
+    # Starting processes costs more than parsing a single file
+    if max_workers <= 1:
+        for path in paths:
+            yield from load_pdf(path)
+        return
+
+    # Indexing calls this from a worker thread, where fork() is unsafe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        for docs in executor.map(_load_pdf_pages, paths):
+            yield from docs
+
+
+def split_pdf(pdfs: Iterable[Document], chunk_size=512, chunk_overlap=64, tiktoken_model=None) -> Iterable[Document]:
+    """
+    Splits Document objects into smaller chunks for retrieval purposes.
+
+    Documents are consumed and split one at a time, so `pdfs` can be a lazy page generator.
     
     Args:
-        pdfs (List[Document]): List of LangChain Document objects.
+        pdfs (Iterable[Document]): LangChain Document objects.
+        chunk_size (int): Maximum chunk size, in characters or tokens
+        chunk_overlap (int): Overlap between consecutive chunks
+        tiktoken_model (str): Measure sizes in tokens of this model instead of characters
 
-    Returns:
-        List[Document]: List of split Document chunks.
+    Yields:
+        Document: Split Document chunks.
     """
-    if not pdfs:
-        return []
+    splitter = _splitter(chunk_size, chunk_overlap, tiktoken_model)
+    for doc in pdfs:
+        for chunk in splitter.chunks(doc.page_content):
+            yield Document(page_content=chunk, metadata=doc.metadata.copy())
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=512,
-        chunk_overlap=64,
-        length_function=len,
-        is_separator_regex=False
-    )
 
-    return splitter.split_documents(pdfs)
+def _content_hash(file):
+    """SHA-256 hex digest of an uploaded file or raw bytes, hashed in place without copying."""
+    if hasattr(file, 'read'):
+        file.seek(0)
+        return hashlib.file_digest(file, 'sha256').hexdigest()
 
+    return hashlib.sha256(file).hexdigest()
 
-def extract_pdf(uploaded_pdf):
+
+def _write_file(file, file_path):
+    """Write an uploaded file or raw bytes under a unique temporary name, then move it into place."""
+    # An interrupted write must not leave a file that looks already extracted, and sessions extracting
+    # the same upload at once must not share a temporary file
+    fd, part_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as w:
+            if hasattr(file, 'read'):
+                # Stream in 1 MiB chunks instead of materializing a copy of the whole file
+                file.seek(0)
+                shutil.copyfileobj(file, w, length=COPY_CHUNK_SIZE)
+            else:
+                w.write(file)
+
+        # A concurrent writer that finished first wrote the same content, so its file can be kept
+        if not os.path.exists(file_path):
+            os.replace(part_path, file_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def _evict_stale(root, max_age):
+    """Delete the extracted file directories under `root` that were not used for `max_age` seconds."""
+    cutoff = time.time() - max_age
+    with os.scandir(root) as entries:
+        for entry in entries:
+            try:
+                stale = entry.is_dir() and entry.stat().st_mtime < cutoff
+            except FileNotFoundError:
+                # Evicted concurrently by another session
+                continue
+            if stale:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def extract_pdf(uploaded_pdf, cache_dir=None, max_age=EXTRACT_CACHE_TTL):
     """
-    Extract uploaded PDF files to a temporary directory with unique file names.
+    Extract uploaded PDF files, each to a directory keyed by its own content hash.
+
+    A file that is already on disk is not written again and keeps its path, whichever upload it came in,
+    so every rerun on the same PDF only costs hashing the in-memory upload. Files not used for `max_age`
+    seconds are evicted, which keeps the cache bounded.
     
     Args:
         uploaded_pdf: Streamlit UploadedFile object or list of UploadedFile objects
+        cache_dir: Root directory for extracted uploads (defaults to ./.cache/pdf_extract)
+        max_age: Seconds an extracted file is kept after its last use
         
     Returns:
-        str: Path to the temporary directory containing extracted files
+        list[str]: Paths of the extracted files, in upload order
     """
-    # Create a unique temporary directory
-    temp_dir = tempfile.mkdtemp(prefix='pdf_extract_')
+    root = create_cache_dir(cache_dir or './.cache/pdf_extract')
+    _evict_stale(root, max_age)
     
-    # Normalize to a list if it's a single file
-    if not isinstance(uploaded_pdf, list):
-        uploaded_pdf = [uploaded_pdf]
+    # Iterate a single file without building a list for it
+    files = iter(uploaded_pdf) if isinstance(uploaded_pdf, list) else iter((uploaded_pdf,))
 
     try:
-        for file in uploaded_pdf:
-            # Generate unique filename to avoid conflicts
-            unique_id = str(uuid.uuid4())
-            
+        paths = []
+        for file in files:
+            file_hash = _content_hash(file)
+
             # Support both Streamlit UploadedFile and raw bytes
-            if hasattr(file, "name") and hasattr(file, "getvalue"):
-                # Use original filename with unique prefix
-                safe_filename = f"{unique_id}_{file.name}"
-                file_path = os.path.join(temp_dir, safe_filename)
-                content = file.getvalue()
+            if hasattr(file, "name") and hasattr(file, "read"):
+                # Keep the original filename under the content hash directory
+                filename = os.path.basename(file.name)
             else:
-                # Assume raw bytes
-                file_path = os.path.join(temp_dir, f"{unique_id}_uploaded.pdf")
-                content = file
+                # Assume raw bytes; without a name to tell versions apart, the content hash is the name
+                filename = f"{file_hash}.pdf"
+
+            directory = os.path.join(root, file_hash[:16])
+            os.makedirs(directory, exist_ok=True)
 
-            with open(file_path, 'wb') as w:
-                w.write(content)
+            file_path = os.path.join(directory, filename)
+            if not os.path.exists(file_path):
+                _write_file(file, file_path)
+            else:
+                # Mark the cached file as recently used
+                os.utime(directory)
+            paths.append(file_path)
                 
     except Exception as e:
-        # Clean up on error
-        import shutil
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise Exception(f"Failed to extract PDF: {str(e)}")
 
-    return temp_dir
-
+    return paths
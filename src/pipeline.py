@@ -0,0 +1,128 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+_DONE = object()
+
+
+class Cancelled(Exception):
+    """Raised inside a stage when the pipeline was cancelled because another stage failed."""
+
+
+class Stage:
+    def __init__(self, fn, workers=1, name='stage'):
+        """
+        A pipeline stage run by a pool of worker threads.
+
+        Args:
+            fn: Callable taking an iterator over the stage's input items and yielding output items.
+                Every worker calls it once; the workers share the same input queue.
+            workers: Number of worker threads running `fn`
+            name: Thread name prefix, useful when debugging
+        """
+        self.fn = fn
+        self.workers = workers
+        self.name = name
+
+
+def batched(items, n):
+    """Group an iterable into lists of at most `n` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _drain(in_queue, cancelled):
+    """
+    Yield items from `in_queue` until the end marker; once cancelled, discard them instead.
+
+    A cancelled stream ends by raising Cancelled rather than returning, so a stage does not mistake it
+    for the end of its input and flush partial work.
+    """
+    while (item := in_queue.get()) is not _DONE:
+        if not cancelled.is_set():
+            yield item
+
+    # Put the marker back so sibling workers reading the same queue stop too
+    in_queue.put(_DONE)
+    if cancelled.is_set():
+        raise Cancelled()
+
+
+def _work(stage, in_queue, out_queue, remaining, lock, cancelled, errors):
+    items = _drain(in_queue, cancelled)
+    try:
+        for item in stage.fn(items):
+            out_queue.put(item)
+    except BaseException as e:
+        errors.append(e)
+        cancelled.set()
+    finally:
+        # Keep consuming so upstream workers blocked on a full queue can finish
+        try:
+            for _ in items:
+                pass
+        except Cancelled:
+            pass
+
+        with lock:
+            remaining[0] -= 1
+            last_worker = remaining[0] == 0
+        if last_worker:
+            out_queue.put(_DONE)
+
+
+def run_pipeline(source, stages, maxsize=256):
+    """
+    Push `source` through `stages`, running every stage concurrently.
+
+    Stages are connected by bounded queues, so a slow stage applies backpressure to the ones before it
+    and memory stays proportional to `maxsize` rather than to the size of the input.
+
+    Args:
+        source: Finite iterable of input items for the first stage (e.g. file paths)
+        stages: List of Stage objects, in order
+        maxsize: Capacity of each queue between two stages
+
+    Returns:
+        list: Items yielded by the last stage.
+    """
+    cancelled = threading.Event()
+    errors = []
+
+    queues = [queue.Queue()] + [queue.Queue(maxsize) for _ in stages[1:]] + [queue.Queue()]
+    for item in source:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+
+    executors = []
+    try:
+        for stage, in_queue, out_queue in zip(stages, queues, queues[1:]):
+            executor = ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=stage.name)
+            executors.append(executor)
+            remaining, lock = [stage.workers], threading.Lock()
+            for _ in range(stage.workers):
+                executor.submit(_work, stage, in_queue, out_queue, remaining, lock, cancelled, errors)
+
+        results = list(_drain(queues[-1], cancelled))
+    except Cancelled:
+        # The failed stage's error is raised below
+        pass
+    except BaseException:
+        cancelled.set()
+        raise
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+    if errors:
+        raise errors[0]
+
+    return results
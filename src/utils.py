@@ -1,8 +1,11 @@
 import json
 import yaml
+from functools import lru_cache
 
 
+@lru_cache(maxsize=1)
 def load_config():
+    """Load config.yaml once per process; the returned dict is shared and must not be modified."""
     with open('./config.yaml', 'r') as f:
         config = yaml.safe_load(f)
 
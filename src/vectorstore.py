@@ -1,22 +1,81 @@
+import blake3
+import xxhash
+import chromadb
 from pinecone import Pinecone, ServerlessSpec, PodSpec
 from langchain_pinecone import PineconeVectorStore
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
-from langchain.indexes import SQLRecordManager, index
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.indexes import SQLRecordManager
+from langchain.storage import LocalFileStore
+from sqlalchemy import create_engine, event
 
-from src.pdf_handler import extract_pdf, load_pdf_directory, split_pdf
+from src.utils import load_config
+from src.pdf_handler import extract_pdf, load_pdf_files, split_pdf
+from src.pipeline import Stage, batched, run_pipeline
 
 import os
-import shutil
+import asyncio
+import weakref
+import threading
+from collections import deque
+from typing import Final
+from functools import lru_cache, partial
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Deployment constants, read from config.yaml once at import
+_config = load_config()
+EMBEDDING_MODEL_NAME: Final[str] = _config['embedding_model']['model_name']
+# Use the embedding dimensions from config instead of hardcoded value
+EMBEDDING_DIM: Final[int] = _config['embedding_model'].get('dimensions', 1536)
+PINECONE_POOL_THREADS: Final[int] = ((_config.get('vector_database') or {}).get('pinecone') or {}).get('pool_threads', 30)
+del _config
 
-def setup_pinecone(index_name, embedding_model, embedding_dim, metric='cosine', use_serverless=True):
+
+class PooledPineconeVectorStore(PineconeVectorStore):
+    """PineconeVectorStore that writes precomputed embeddings as parallel asynchronous upserts."""
+
+    def add_embeddings(self, texts, embeddings, metadatas, ids, batch_size=100):
+        """
+        Upsert precomputed embeddings in requests of `batch_size` vectors, all in flight at once.
+
+        The requests run on the index's `pool_threads` connection pool; this waits for all of them.
+        """
+        vectors = [
+            {'id': id_, 'values': embedding, 'metadata': {**metadata, self._text_key: text}}
+            for id_, text, embedding, metadata in zip(ids, texts, embeddings, metadatas)
+        ]
+        async_results = [
+            self._index.upsert(vectors=vectors[start:start + batch_size], namespace=self._namespace, async_req=True)
+            for start in range(0, len(vectors), batch_size)
+        ]
+        for result in async_results:
+            result.get()
+
+        return ids
+
+
+@lru_cache(maxsize=1)
+def get_embedding_model():
+    """Shared OpenAI embedding model; its HTTP client and connection pool are reused by every VectorDB."""
+    return OpenAIEmbeddings(
+        model=EMBEDDING_MODEL_NAME,
+        openai_api_key=os.environ.get('OPENAI_API_KEY')
+    )
+
+
+@lru_cache(maxsize=1)
+def get_pinecone_client():
+    """Shared Pinecone client, so its connection is not set up again for every index."""
+    return Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+
+
+def setup_pinecone(index_name, embedding_model, embedding_dim, metric='cosine', use_serverless=True, pool_threads=30):
     """Setup Pinecone vector database with proper error handling and dimension checking."""
     try:
-        pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
+        pc = get_pinecone_client()
         
         # Check if index exists and get its current dimensions
         index_exists = index_name in pc.list_indexes().names()
@@ -51,11 +110,19 @@ def setup_pinecone(index_name, embedding_model, embedding_dim, metric='cosine',
             )
             print(f"Created Pinecone index '{index_name}' with {embedding_dim} dimensions")
         
-        return PineconeVectorStore(index_name=index_name, embedding=embedding_model)
+        # A connection pool of `pool_threads` lets upsert batches be sent in parallel
+        index = pc.Index(index_name, pool_threads=pool_threads)
+        return PooledPineconeVectorStore(index=index, embedding=embedding_model)
     except Exception as e:
         raise Exception(f"Failed to setup Pinecone: {str(e)}")
 
 
+@lru_cache(maxsize=None)
+def get_chroma_client(persist_directory):
+    """Shared persistent Chroma client for a directory."""
+    return chromadb.PersistentClient(path=persist_directory)
+
+
 def setup_chroma(index_name, embedding_model, persist_directory=None):
     """Setup Chroma vector database."""
     if not persist_directory:
@@ -63,69 +130,302 @@ def setup_chroma(index_name, embedding_model, persist_directory=None):
 
     os.makedirs(persist_directory, exist_ok=True)
 
-    db = Chroma(index_name, embedding_function=embedding_model, persist_directory=persist_directory)
+    db = Chroma(index_name, embedding_function=embedding_model, client=get_chroma_client(persist_directory))
     return db
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL with relaxed syncing: commits no longer fsync the database file each time."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def create_sqlite_engine(db_path):
+    """Create a SQLAlchemy engine for a local SQLite database tuned for frequent small writes."""
+    engine = create_engine(f'sqlite:///{db_path}')
+    event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
+
+
+# Vectors per write: Pinecone splits each write into parallel 100-vector requests, Chroma writes it in one call
+DEFAULT_UPSERT_BATCH_SIZE = {'pinecone': 1000, 'chroma': 2000}
+
+
+def group_id(chunk):
+    """Record-manager group of a chunk: the name of the file it came from, shared by all versions of the file."""
+    return os.path.basename(chunk.metadata['source'])
+
+
+def chunk_id(chunk):
+    """
+    Deterministic vector id for a chunk, so re-indexing the same content overwrites instead of duplicating.
+
+    Keyed by the file name rather than the extracted path, so unchanged chunks of an edited file keep their ids.
+    """
+    key = f"{group_id(chunk)}:{chunk.metadata.get('page')}:{chunk.page_content}"
+    return blake3.blake3(key.encode('utf-8')).hexdigest(length=16)
+
+
+def content_hash(text):
+    """Non-cryptographic hash of a chunk's text, used to embed identical chunks only once."""
+    return xxhash.xxh3_128_intdigest(text.encode('utf-8'))
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop():
+    """
+    Long-lived background event loop for async embedding requests.
+
+    `asyncio.run` would close its loop after every call, leaving the async OpenAI client's
+    pooled connections bound to a dead loop; a single loop lets them be reused across indexing runs.
+    """
+    global _loop
+    # Unlike lru_cache, the lock guarantees one loop when sessions index concurrently on first use
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='vectordb-event-loop', daemon=True).start()
+
+    return _loop
+
+
+def submit_async(coro):
+    """Schedule a coroutine on the background event loop and return a concurrent.futures.Future for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
+
+
 class VectorDB:
-    def __init__(self, db_name, index_name, cache_dir=None):
-        from src.utils import load_config
+    # Attributes are fixed, so skip the per-instance __dict__; __weakref__ is needed by weakref.finalize
+    __slots__ = ('cache_dir', 'db_name', 'embedding', 'embed_batch_size', 'upsert_batch_size', 'embed_concurrency',
+                 'queue_size', 'vectorstore', 'chroma_client', '_collection', 'record_manager', '__weakref__')
 
-        config = load_config()
-        embedding = OpenAIEmbeddings(
-            model=config['embedding_model']['model_name'],
-            openai_api_key=os.environ.get('OPENAI_API_KEY')
-        )
+    def __init__(self, db_name, index_name, cache_dir=None, embed_batch_size=128, upsert_batch_size=None,
+                 embed_concurrency=8, queue_size=512, embedding=None):
+        """
+        Args:
+            db_name: Database type ('pinecone' or 'chroma')
+            index_name: Pinecone index / Chroma collection name
+            cache_dir: Directory for the local database and record manager
+            embed_batch_size: Number of chunks sent per embedding request
+            upsert_batch_size: Number of vectors written per upsert (defaults per database type)
+            embed_concurrency: Maximum number of embedding requests in flight at once
+            queue_size: Capacity of the queues between indexing stages
+            embedding: Embedding model to use (defaults to the shared model from `get_embedding_model`)
+        """
+        if embedding is None:
+            embedding = get_embedding_model()
 
         if not cache_dir:
             cache_dir = './.cache/database'
         self.cache_dir = cache_dir
-        os.makedirs(self.cache_dir, exist_ok=True)
 
-        # Use the embedding dimensions from config instead of hardcoded value
-        embedding_dim = config['embedding_model'].get('dimensions', 1536)
+        # Persist document embeddings keyed on a hash of the chunk text, so unchanged chunks are never re-embedded
+        embedding = CacheBackedEmbeddings.from_bytes_store(
+            embedding,
+            LocalFileStore(f'{self.cache_dir}/emb_cache/'),
+            namespace=getattr(embedding, 'model', EMBEDDING_MODEL_NAME),
+            # The default SHA-1 cache keys are deprecated and warn on every construction
+            key_encoder='sha256'
+        )
+        self.db_name = db_name
+        self.embedding = embedding
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size or DEFAULT_UPSERT_BATCH_SIZE.get(db_name, 100)
+        self.embed_concurrency = embed_concurrency
+        self.queue_size = queue_size
+        os.makedirs(self.cache_dir, exist_ok=True)
 
+        self.chroma_client = None
+        self._collection = None
         if db_name == 'pinecone':
-            self.vectorstore = setup_pinecone(index_name, embedding, embedding_dim, 'cosine')
+            self.vectorstore = setup_pinecone(index_name, embedding, EMBEDDING_DIM, 'cosine',
+                                              pool_threads=PINECONE_POOL_THREADS)
         else:
             self.vectorstore = setup_chroma(index_name, embedding, self.cache_dir)
+            self.chroma_client = get_chroma_client(self.cache_dir)
+            # Raw collection for bulk writes; the wrapper keeps its embedding function for queries
+            self._collection = self.chroma_client.get_or_create_collection(index_name, embedding_function=None)
+            # A single Chroma write may not exceed the client's maximum batch size
+            self.upsert_batch_size = min(self.upsert_batch_size, self.chroma_client.get_max_batch_size())
 
         namespace = f'{db_name}/{index_name}'
         self.record_manager = SQLRecordManager(namespace,
-                                               db_url=f'sqlite:///{self.cache_dir}/record_manager_cache.sql')
+                                               engine=create_sqlite_engine(f'{self.cache_dir}/record_manager_cache.sql'))
         self.record_manager.create_schema()
 
-    def index(self, uploaded_file):
-        """Index uploaded PDF file into the vector database."""
+        # Dispose the engine when this object is collected; unlike __del__, this also runs safely at interpreter exit
+        weakref.finalize(self, self.record_manager.engine.dispose)
+
+    def index(self, uploaded_file, incremental=None):
+        """
+        Index uploaded PDF file into the vector database.
+
+        Args:
+            uploaded_file: Streamlit UploadedFile object or list of UploadedFile objects
+            incremental: Whether the upload replaces previously indexed versions of the same files, in which case
+                their stale chunks are deleted afterwards. Defaults to whether a file of the same name was indexed
+                before; new files take the append-only fast path.
+        """
         try:
-            directory = extract_pdf(uploaded_file)
-            docs = load_pdf_directory(directory)
-            chunks = split_pdf(docs)
-
-            index(
-                docs_source=chunks,
-                record_manager=self.record_manager,
-                vector_store=self.vectorstore,
-                cleanup='full',
-                source_id_key='source'
-            )
+            sources = extract_pdf(uploaded_file)
+            # Extracted paths change with the content, so versions of a file are grouped by its original name;
+            # raw bytes are named by their content hash, so different ones never replace each other
+            names = [os.path.basename(source) for source in sources]
+            if incremental is None:
+                incremental = bool(self.record_manager.list_keys(group_ids=names, limit=1))
 
-            # Clean up temporary files
-            for file in os.listdir(directory):
-                os.remove(os.path.join(directory, file))
-            os.rmdir(directory)
+            # Load -> Split -> Embed -> Upsert, with all four stages running concurrently
+            index_start = self.record_manager.get_time()
+            # Each write is tracked by the record manager as it happens, so a failed run leaves no untracked vectors
+            written = dict(run_pipeline(
+                [sources],
+                [
+                    Stage(self._load_stage, name='load'),
+                    Stage(self._split_stage, name='split'),
+                    Stage(self._embed_stage, name='embed'),
+                    Stage(partial(self._upsert_stage, index_start=index_start), name='upsert'),
+                ],
+                maxsize=self.queue_size
+            ))
+            # Image-only or blank PDFs give no chunks; keep the previous version rather than deleting it
+            if written and incremental:
+                self._cleanup(names, before=index_start)
+
+            # The extracted files are kept: extract_pdf reuses them until they go unused for a day
             
         except Exception as e:
             raise Exception(f"Failed to index document: {str(e)}")
 
-    def as_retriever(self):
-        return self.vectorstore.as_retriever()
+    # Parsing fans out to a process pool inside the load stage; splitting holds the GIL, so one thread each
+    def _load_stage(self, uploads):
+        for paths in uploads:
+            yield from load_pdf_files(paths)
+
+    def _split_stage(self, pages):
+        yield from split_pdf(pages)
+
+    def _embed_stage(self, chunks):
+        """
+        Embed micro-batches with `aembed_documents`, keeping up to `embed_concurrency` requests in flight.
+
+        Each distinct text is sent to the API once per indexing run; a chunk whose text was taken by an earlier
+        batch is yielded without an embedding and resolved by the upsert stage. Batches are yielded in order.
+        """
+        claimed = set()
+        in_flight = deque()
+
+        def collect(batch, hashes, future):
+            embeddings = future.result() if future is not None else {}
+            return [(chunk, embeddings.get(hash_)) for chunk, hash_ in zip(batch, hashes)]
+
+        async def embed(texts):
+            return dict(zip(texts, await self.embedding.aembed_documents(list(texts.values()))))
 
-    def __del__(self):
         try:
-            # Try to close the SQLite connection gracefully first
-            if hasattr(self.record_manager, 'engine'):
-                self.record_manager.engine.dispose()
-            # Don't remove the cache directory as it might be needed for persistence
-        except Exception as e:
-            print(f"Cleanup warning: {e}")
+            for batch in batched(chunks, self.embed_batch_size):
+                hashes = [content_hash(chunk.page_content) for chunk in batch]
+                texts = {}
+                for chunk, hash_ in zip(batch, hashes):
+                    if hash_ in texts or hash_ not in claimed:
+                        claimed.add(hash_)
+                        texts[hash_] = chunk.page_content
+
+                in_flight.append((batch, hashes, submit_async(embed(texts)) if texts else None))
+                if len(in_flight) >= self.embed_concurrency:
+                    yield collect(*in_flight.popleft())
+
+            while in_flight:
+                yield collect(*in_flight.popleft())
+        finally:
+            # Left over when indexing is cancelled
+            for *_, future in in_flight:
+                if future is not None:
+                    future.cancel()
+
+    def _upsert_stage(self, embedded_batches, index_start):
+        """Coalesce embedded micro-batches into `upsert_batch_size` writes and yield (id, chunk) pairs."""
+        seen = set()
+        pending = []
+
+        def add(chunk, embedding):
+            id_ = chunk_id(chunk)
+            # Identical chunks map to the same id; writing one id twice in a batch is rejected by Chroma
+            if id_ not in seen:
+                seen.add(id_)
+                pending.append((id_, chunk, embedding))
+
+        for batch in embedded_batches:
+            late = []
+            for chunk, embedding in batch:
+                if embedding is not None:
+                    add(chunk, embedding)
+                else:
+                    late.append(chunk)
+
+            # Batches arrive in order, so their text was embedded by an earlier batch and is served from the cache
+            if late:
+                for chunk, embedding in zip(late, self.embedding.embed_documents([c.page_content for c in late])):
+                    add(chunk, embedding)
+
+            while len(pending) >= self.upsert_batch_size:
+                yield from self._write(pending[:self.upsert_batch_size], index_start)
+                pending = pending[self.upsert_batch_size:]
+
+        if pending:
+            yield from self._write(pending, index_start)
+
+    def _write(self, records, index_start):
+        """
+        Write the records the record manager has not seen, then record the whole batch as written by this run.
+
+        Already indexed ids are not written again, only their timestamp is refreshed. Like `index()`, the
+        record manager is updated per batch, so vectors written before a failure can still be cleaned up.
+        """
+        ids, chunks, _ = zip(*records)
+        exists = self.record_manager.exists(list(ids))
+
+        new = [record for record, seen in zip(records, exists) if not seen]
+        if new:
+            new_ids, new_chunks, embeddings = zip(*new)
+            self.add_with_embeddings(
+                [chunk.page_content for chunk in new_chunks],
+                list(embeddings),
+                list(new_ids),
+                [chunk.metadata for chunk in new_chunks]
+            )
+
+        self.record_manager.update(
+            list(ids),
+            group_ids=[group_id(chunk) for chunk in chunks],
+            time_at_least=index_start
+        )
+        return zip(ids, chunks)
+
+    def add_with_embeddings(self, texts, embeddings, ids, metadatas):
+        """
+        Write texts with precomputed embeddings, bypassing the vector store's embedding function.
+
+        Args:
+            texts (list[str]): Chunk texts
+            embeddings (list[list[float]]): One embedding per text
+            ids (list[str]): Vector ids
+            metadatas (list[dict]): One metadata dict per text
+        """
+        if self.db_name == 'pinecone':
+            self.vectorstore.add_embeddings(texts, embeddings, metadatas, ids)
+        else:
+            self._collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts)
+
+    def _cleanup(self, names, before, batch_size=1000):
+        """Delete vectors of the files `names` that were not written by the latest indexing run (same as `cleanup='incremental'`)."""
+        while stale_ids := self.record_manager.list_keys(group_ids=names, before=before, limit=batch_size):
+            self.vectorstore.delete(stale_ids)
+            self.record_manager.delete_keys(stale_ids)
+
+    def as_retriever(self):
+        return self.vectorstore.as_retriever()